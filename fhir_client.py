@@ -1,78 +1,346 @@
 # fhir_client.py
 import logging
-from typing import List
-import requests
+import threading
+
+import orjson
+from typing import Dict, Iterator, List
+import httpx
 from fhir.resources.patient import Patient
 from fhir.resources.observation import Observation
-from fhirpathpy import evaluate as fhirpath
 
 FHIR_BASE = "https://iris.rpaihtnv03ms.sandbox-eng-paas.isccloud.io/csp/healthshare/fhir/fhir/r4a"
 #FHIR_BASE="https://3.17.248.24/csp/healthshare/fhir/fhir/r4"
 logger = logging.getLogger(__name__)  # Inherits handlers configured by the app
 
-
-def _headers(bearer: str) -> dict[str, str]:
-    return {
-        "Authorization": f"Bearer {bearer}",
+# ---------------------------------------------------------------------------
+# Shared HTTP client – one connection pool for every FHIR call, so repeat
+# requests to the same host reuse the TCP+TLS connection instead of paying a
+# full handshake each time.  With HTTP/2 enabled, concurrent calls (e.g. the
+# observation fan-out) multiplex over a single TLS connection, and the
+# Accept-Encoding header lets the server compress the JSON bundles.
+# Transport retries cover transient connection failures.
+# ---------------------------------------------------------------------------
+_CLIENT = httpx.Client(
+    http2=True,
+    headers={
         "Accept": "application/fhir+json",
+        "Accept-Encoding": "gzip, br",
         "Content-Type": "application/fhir+json",
         "Prefer": "return=representation",
-    }
+    },
+    timeout=10.0,
+    transport=httpx.HTTPTransport(retries=3, http2=True),
+)
+
+
+def get_client() -> httpx.Client:
+    """Return the process-wide pooled HTTP/2 client used for FHIR calls.
+
+    Every helper in this module already shares it; exposing it lets apps
+    issue ad-hoc requests (e.g. following a stored next-page URL) over the
+    same keep-alive pool instead of standing up their own client.
+    """
+    return _CLIENT
+
+
+_TOKEN: str | None = None
+
+
+def set_token(token: str | None) -> None:
+    """Attach the OAuth bearer to the shared client's default headers.
+
+    The token only changes on login/logout, so holding it on the client
+    avoids rebuilding a headers dict on every FHIR call.  Passing ``None``
+    clears the header.
+    """
+    global _TOKEN
+    if token == _TOKEN:
+        return
+    _TOKEN = token
+    if token is None:
+        _CLIENT.headers.pop("Authorization", None)
+    else:
+        _CLIENT.headers["Authorization"] = f"Bearer {token}"
+
+
+def clear_token() -> None:
+    """Forget the bearer token (call on logout)."""
+    set_token(None)
+
+
+def _mask_token(tok: str) -> str:
+    """Never log a full bearer token – the first few characters suffice."""
+    return tok[:8] + "…" if tok else "<none>"
+
+
+# ---------------------------------------------------------------------------
+# Parsed-model cache – pydantic validation is the dominant client-side cost on
+# large bundles, and re-browsing the same patients re-validates identical
+# resources.  Keyed by (resourceType, id, versionId) so a server-side edit
+# (new versionId) naturally misses the cache.
+# ---------------------------------------------------------------------------
+_MODEL_CACHE: dict[tuple[str, str, str], object] = {}
+_MODEL_CACHE_LOCK = threading.Lock()
+_MODEL_CACHE_MAX = 4096
+
+
+def _parse_resource(model_cls, raw: dict):
+    """Parse `raw` with `model_cls`, reusing a cached model when possible.
+
+    Resources without an id or meta.versionId cannot be keyed safely, so they
+    are parsed fresh every time.
+    """
+    resource_id = raw.get("id")
+    version_id = (raw.get("meta") or {}).get("versionId")
+    if resource_id is None or version_id is None:
+        return model_cls.parse_obj(raw)
+
+    key = (raw.get("resourceType"), resource_id, version_id)
+    with _MODEL_CACHE_LOCK:
+        cached = _MODEL_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    model = model_cls.parse_obj(raw)
+    with _MODEL_CACHE_LOCK:
+        if len(_MODEL_CACHE) >= _MODEL_CACHE_MAX:
+            # Evict the oldest ~10% (dicts iterate in insertion order) so we
+            # never grow without bound but also never thrash on one insert.
+            for old_key in list(_MODEL_CACHE)[: _MODEL_CACHE_MAX // 10]:
+                del _MODEL_CACHE[old_key]
+        _MODEL_CACHE[key] = model
+    return model
+
+def _bundle_resources(bundle: dict) -> list[dict]:
+    """Extract `entry[*].resource` from a Bundle without the FHIRPath engine.
+
+    The path is a constant one-liner, so paying fhirpathpy's parse/evaluate
+    overhead per bundle bought us nothing.
+    """
+    return [e["resource"] for e in bundle.get("entry", []) if "resource" in e]
 
 def get_patient(patient_id: str, token: str) -> Patient:
     url = f"{FHIR_BASE}/Patient/{patient_id}"
-    r = requests.get(url, headers=_headers(token))
+    set_token(token)
+    r = _CLIENT.get(url)
     r.raise_for_status()
-    return Patient.parse_obj(r.json())
+    return _parse_resource(Patient, r.json())
 
 def search_patients(params: str, token: str) -> List[Patient]:
     """Search the Patient endpoint and parse the _Bundle_ into `Patient` objects.
 
-    All network activity and key state (URL, status‑code, patient‑count, etc.)
-    is logged at INFO level; the OAuth token is logged (masked) at the **same
-    level**, so it shows up even when your root logger is set to INFO.
+    Request details (URL, status-code, masked token) are logged at DEBUG so
+    the hot path stays quiet in normal runs; only the patient count is
+    reported at INFO.
     """
     url = f"{FHIR_BASE}/Patient?{params}"
 
     # ---- Log request context ------------------------------------------------
-    logger.info("FHIR GET %s", url)
-    logger.info("OAuth token (masked): %s", token)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("FHIR GET %s", url)
+        logger.debug("OAuth token (masked): %s", _mask_token(token))
 
+    set_token(token)
     try:
-        response = requests.get(
-            url,
-            headers=_headers(token)
-        )
-        logger.info("FHIR response status: %s", response.status_code)
+        response = _CLIENT.get(url)
+        logger.debug("FHIR response status: %s", response.status_code)
         response.raise_for_status()
-    except requests.HTTPError as exc:
+    except httpx.HTTPStatusError as exc:
         logger.error(
             "FHIR request failed (%s): %s", response.status_code, response.text[:300]
         )
         raise  # Let caller decide what to do with the error.
 
-    bundle = response.json()
-    raw = fhirpath(bundle, "Bundle.entry.resource")
-    patients = [Patient.parse_obj(p) for p in raw if p.get("resourceType") == "Patient"]
+    bundle = orjson.loads(response.content)
+    raw = _bundle_resources(bundle)
+    patients = [_parse_resource(Patient, p) for p in raw if p.get("resourceType") == "Patient"]
 
     logger.info("Found %d Patient resources", len(patients))
     return patients
 
  
-def observations_for_patient(patient_id: str, token: str) -> list[Observation]:
+def observations_for_patient(
+    patient_id: str, token: str, elements: str | None = None
+) -> list[Observation]:
+    """Fetch a patient's observations, optionally restricted via `_elements`.
+
+    Passing e.g. ``elements="code,valueQuantity,effectiveDateTime"`` tells the
+    server to strip everything else from the returned resources, shrinking
+    both the payload and the client-side parse.
+    """
     url = f"{FHIR_BASE}/Observation?subject=Patient/{patient_id}"
+    if elements:
+        url += f"&_elements={elements}"
     try:
-        logger.info("FHIR GET %s", url)
-        logger.info("OAuth token (masked): %s", token)
-        r = requests.get(url, headers=_headers(token))
-        bundle = r.json()
-        raw = fhirpath(bundle, "Bundle.entry.resource")
-        return [Observation.parse_obj(o) for o in raw if o.get("resourceType") == "Observation"]
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("FHIR GET %s", url)
+            logger.debug("OAuth token (masked): %s", _mask_token(token))
+        set_token(token)
+        r = _CLIENT.get(url)
+        bundle = orjson.loads(r.content)
+        raw = _bundle_resources(bundle)
+        return [_parse_resource(Observation, o) for o in raw if o.get("resourceType") == "Observation"]
 
     except Exception as e:
-        logger.info(
+        logger.error(
             "FHIR request failed (%s): %s", r.status_code, r.text[:300]
         )
         raise  # Let caller decide what to do with the error.
-   
-    
\ No newline at end of file
+
+
+def search_patients_lite(params: str, token: str) -> list[dict]:
+    """Search Patients but skip pydantic, returning plain projection dicts.
+
+    The server we talk to is our own trusted FHIR endpoint and the Patients
+    table only shows four fields, so validating the full Patient schema graph
+    per entry is wasted work.  Each returned dict has exactly the keys
+    ``id``, ``family``, ``gender`` and ``birthDate``.  Use `search_patients`
+    when a real `Patient` model is required.
+    """
+    url = f"{FHIR_BASE}/Patient?{params}"
+    logger.debug("FHIR GET %s", url)
+    set_token(token)
+    response = _CLIENT.get(url)
+    response.raise_for_status()
+
+    bundle = orjson.loads(response.content)
+    rows: list[dict] = []
+    for res in _bundle_resources(bundle):
+        if res.get("resourceType") != "Patient":
+            continue
+        name = (res.get("name") or [{}])[0]
+        rows.append(
+            {
+                "id": res.get("id"),
+                "family": name.get("family"),
+                "gender": res.get("gender"),
+                "birthDate": res.get("birthDate"),
+            }
+        )
+    logger.info("Found %d Patient resources", len(rows))
+    return rows
+
+
+def observations_for_patient_lite(patient_id: str, token: str) -> list[tuple]:
+    """Fetch observations as ready-to-display ``(code, value, unit, when)`` tuples.
+
+    Same trusted-server rationale as `search_patients_lite`: the Observations
+    table wants four columns, so we project straight off the raw entry dicts
+    instead of building validated `Observation` models – and `_elements`
+    tells the server to strip everything but those four fields before the
+    bundle ever crosses the wire.
+    """
+    url = (
+        f"{FHIR_BASE}/Observation?subject=Patient/{patient_id}"
+        "&_elements=code,valueQuantity,effectiveDateTime,effectivePeriod"
+        "&_count=1000"
+    )
+    logger.debug("FHIR GET %s", url)
+    set_token(token)
+    response = _CLIENT.get(url)
+    response.raise_for_status()
+
+    bundle = orjson.loads(response.content)
+    rows: list[tuple] = []
+    for res in _bundle_resources(bundle):
+        if res.get("resourceType") != "Observation":
+            continue
+        code = res.get("code") or {}
+        coding = code.get("coding") or []
+        if coding:
+            code_display = coding[0].get("display") or coding[0].get("code")
+        else:
+            code_display = code.get("text", "(no code)")
+
+        quantity = res.get("valueQuantity")
+        value = str(quantity["value"]) if quantity and "value" in quantity else "-"
+        unit = quantity.get("unit", "") if quantity else ""
+
+        when = res.get("effectiveDateTime") or (res.get("effectivePeriod") or {}).get("start", "")
+        rows.append((code_display, value, unit, when))
+    return rows
+
+
+def iter_observation_pages(
+    patient_id: str, token: str, count: int = 50, elements: str | None = None
+) -> Iterator[list[Observation]]:
+    """Yield a patient's observations one page at a time.
+
+    Asks the server for `_count`-sized bundles and follows
+    ``Bundle.link[rel=next]``, so callers (e.g. a scrolling table) can show
+    the first page immediately instead of materializing every row up front.
+    `elements` is forwarded as `_elements` to filter each resource
+    server-side.
+    """
+    set_token(token)
+    url = f"{FHIR_BASE}/Observation?subject=Patient/{patient_id}&_count={count}"
+    if elements:
+        url += f"&_elements={elements}"
+    while url:
+        logger.debug("FHIR GET %s", url)
+        response = _CLIENT.get(url)
+        response.raise_for_status()
+
+        bundle = orjson.loads(response.content)
+        yield [
+            _parse_resource(Observation, o)
+            for o in _bundle_resources(bundle)
+            if o.get("resourceType") == "Observation"
+        ]
+        url = next(
+            (l.get("url") for l in bundle.get("link", []) if l.get("relation") == "next"),
+            None,
+        )
+
+
+def observations_for_patients(
+    patient_ids: List[str], token: str, chunk_size: int = 50
+) -> Dict[str, list[Observation]]:
+    """Fetch observations for several patients in bundled searches.
+
+    Uses the FHIR search "OR" idiom – a comma-separated list of subject
+    references – so one bundle serves up to `chunk_size` patients instead of
+    one round trip each.  Ids are chunked to stay under URL length limits,
+    and the results are grouped back by patient id via `subject.reference`.
+    """
+    results: Dict[str, list[Observation]] = {pid: [] for pid in patient_ids}
+    if not patient_ids:
+        return results
+
+    set_token(token)
+    for start in range(0, len(patient_ids), chunk_size):
+        chunk = patient_ids[start : start + chunk_size]
+        subjects = ",".join(f"Patient/{pid}" for pid in chunk)
+        url = f"{FHIR_BASE}/Observation?subject={subjects}&_count=1000"
+        logger.debug("FHIR GET %s", url)
+        response = _CLIENT.get(url)
+        response.raise_for_status()
+
+        bundle = orjson.loads(response.content)
+        for res in _bundle_resources(bundle):
+            if res.get("resourceType") != "Observation":
+                continue
+            reference = (res.get("subject") or {}).get("reference") or ""
+            pid = reference.rpartition("/")[2]
+            if pid in results:
+                results[pid].append(_parse_resource(Observation, res))
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Warm-up – the first Patient/Observation parse triggers pydantic's schema
+# materialization for the whole fhir.resources field graph (hundreds of ms).
+# Compile the validators on a daemon thread at import so the cost is paid
+# before the user's first click, without slowing the import itself.
+# ---------------------------------------------------------------------------
+def _warm_models() -> None:
+    try:
+        Patient.parse_obj({"resourceType": "Patient", "id": "warm"})
+        Observation.parse_obj(
+            {"resourceType": "Observation", "status": "final", "code": {"text": "x"}}
+        )
+    except Exception:  # noqa: BLE001 – warm-up is best effort only
+        pass
+
+
+threading.Thread(target=_warm_models, daemon=True).start()
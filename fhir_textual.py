@@ -5,9 +5,10 @@ Textual SMART-on-FHIR demo:
 """
 
 from __future__ import annotations
-import asyncio, json, os, webbrowser, http.server, socketserver
+import asyncio, json, os, ssl, webbrowser, http.server, socketserver
 from urllib.parse import urlparse, parse_qs
 import requests
+from requests.adapters import HTTPAdapter
 from authlib.integrations.requests_client import OAuth2Session
 from textual.app import App, ComposeResult
 from textual.widget import Widget
@@ -34,6 +35,27 @@ if not all([AUTH_DOMAIN, CLIENT_ID, CLIENT_SECRET]):
         "Check your .env file or export them in the shell."
     )
 
+# ---------------------------------------------------------------------------
+# TLS setup – one SSLContext for the whole process.  Building it per call
+# re-reads the trust store every time; sharing it also lets the session
+# reuse TLS tickets.  Point FHIR_CA_BUNDLE at a pinned CA (for example the
+# intersystems.crt in this repo) when talking to the raw-IP sandbox server
+# instead of disabling verification.
+# ---------------------------------------------------------------------------
+_SSL_CONTEXT = ssl.create_default_context(cafile=os.getenv("FHIR_CA_BUNDLE") or None)
+
+
+class _SSLContextAdapter(HTTPAdapter):
+    """HTTPAdapter that hands our shared SSLContext to urllib3."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["ssl_context"] = _SSL_CONTEXT
+        return super().init_poolmanager(*args, **kwargs)
+
+
+SESSION = requests.Session()
+SESSION.mount("https://", _SSLContextAdapter())
+
 class OneShotTCPServer(socketserver.TCPServer):
     allow_reuse_address = True          # 👈 tell OS “it’s fine, I know this port”
 
@@ -44,7 +66,10 @@ class CodeHandler(http.server.BaseHTTPRequestHandler):
         self.send_response(200); self.end_headers()
         self.wfile.write(b"You may now close this tab.")
         params = parse_qs(urlparse(self.path).query)
-        self.server.code = params.get("code", [None])[0]  # type: ignore[attr-defined]
+        code = params.get("code", [None])[0]
+        if code is not None:
+            # Ignore stray GETs (favicon, prefetch) that carry no ?code=.
+            self.server.code = code  # type: ignore[attr-defined]
 
 class SmartFHIRApp(App):
     CSS_PATH = "app.tcss"  # use default dark theme
@@ -117,7 +142,8 @@ class SmartFHIRApp(App):
     # 127.0.0.1   works better than localhost, must also have
     # One shot TCP server listenting on 8900
       with OneShotTCPServer(("127.0.0.1", 8900), CodeHandler) as srv:
-        while getattr(srv, "code", None) is None:
+        srv.code = None  # type: ignore[attr-defined]
+        while srv.code is None:  # type: ignore[attr-defined]
             srv.handle_request()
       code: str = srv.code                  # type: ignore[attr-defined]
       self.dual_log(log, f"[green]Received code[/green] {code}")
@@ -161,8 +187,8 @@ class SmartFHIRApp(App):
             "Authorization": f"Bearer {self.token}",
             "Accept": "application/fhir+json"
         }
-        r = requests.get(f"{FHIR_BASE}/Patient/2",
-                         headers=headers)
+        r = SESSION.get(f"{FHIR_BASE}/Patient/2",
+                        headers=headers)
         r.raise_for_status()
         log.write(json.dumps(r.json(), indent=2))
 
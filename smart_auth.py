@@ -25,14 +25,17 @@ import json
 import logging
 import os
 import socketserver
+import time
 import webbrowser
+from pathlib import Path
 from typing import Optional
 from urllib.parse import parse_qs, urlparse
 
-import requests
 from authlib.integrations.requests_client import OAuth2Session
 #from jose import jwt
 
+import fhir_client
+
 
 logger = logging.getLogger(__name__)
 logger.propagate = True
@@ -50,6 +53,16 @@ REDIRECT_URI  = os.getenv("AUTH0_REDIRECT_URI", "http://127.0.0.1:8900/cb")
 SCOPE         = os.getenv("AUTH0_SCOPE", "openid profile user/*.*")
 PATIENT_CLAIM = os.getenv("PATIENT_CLAIM_NS", "https://fhir.example.com/claims/patient")
 
+# On-disk token cache – lets a restarted app reuse a still-valid token
+# instead of bouncing through the browser flow (and the IdP's rate limits)
+# on every launch.
+_TOKEN_CACHE_FILE = Path.home() / ".cache" / "fhirlesson39" / "token.json"
+
+
+def _cache_key() -> str:
+    """Identify which tenant/client/scopes a cached token belongs to."""
+    return f"{AUTH_DOMAIN}|{CLIENT_ID}|{SCOPE}"
+
 # ---------------------------------------------------------------------------
 # One‑shot TCP server (identical to fhir_textual.py)
 # ---------------------------------------------------------------------------
@@ -65,7 +78,11 @@ class _CodeHandler(http.server.BaseHTTPRequestHandler):
         self.send_response(200); self.end_headers()
         self.wfile.write(b"<html><body><h2>You may now close this tab.</h2></body></html>")
         params = parse_qs(urlparse(self.path).query)
-        self.server.code = params.get("code", [None])[0]  # type: ignore[attr-defined]
+        code = params.get("code", [None])[0]
+        if code is not None:
+            # Only the real callback carries ?code= – favicon/prefetch GETs
+            # must not touch the server state or they could clobber it.
+            self.server.code = code  # type: ignore[attr-defined]
 
     def log_message(self, *_):  # silence default logging
         return
@@ -81,23 +98,56 @@ class SmartAuth:
         self.token: Optional[str] = None           # Bearer token
         self.id_token: Optional[str] = None        # raw ID token (if returned)
         self.patient_ref: Optional[str] = None     # e.g. "Patient/1"
-        self.session = requests.Session()
+        self.refresh_token: Optional[str] = None   # for silent renewal
+        self.expires_at: Optional[float] = None    # epoch seconds
+        self._claims: Optional[dict] = None        # decoded JWT payload cache
+        # authlib's OAuth2Session *is* a requests.Session, so building it once
+        # here lets authorize, fetch_token and any later refresh share one
+        # connection pool (one TLS handshake to the IdP per process, not per
+        # login step).
+        self.session = OAuth2Session(
+            CLIENT_ID,
+            redirect_uri=REDIRECT_URI,
+            scope=SCOPE,
+            code_challenge_method="S256",
+        )
 
     # ------------------------------------------------------------------
     # Public API
     # ------------------------------------------------------------------
+    @classmethod
+    def load_cached(cls) -> Optional["SmartAuth"]:
+        """Return an authenticated instance from the on-disk token cache.
+
+        Gives back ``None`` when there is no cache, it was written for a
+        different (domain, client, scopes) tuple, or the token expires within
+        the next minute – callers then fall through to the browser flow.
+        """
+        try:
+            data = json.loads(_TOKEN_CACHE_FILE.read_text())
+        except (OSError, ValueError):
+            return None
+        if data.get("key") != _cache_key():
+            return None
+        expires_at = data.get("expires_at")
+        if not data.get("access_token") or not expires_at or expires_at - time.time() < 60:
+            return None
+
+        auth = cls()
+        auth.token = data["access_token"]
+        auth.id_token = data.get("id_token")
+        auth.refresh_token = data.get("refresh_token")
+        auth.expires_at = expires_at
+        auth._claims = cls._decode_claims(auth.token)
+        fhir_client.set_token(auth.token)
+        logger.info("Reusing cached access token (masked): %s", cls._mask(auth.token))
+        return auth
+
     def login(self) -> str:
         """Launch browser, run PKCE flow, return access token (blocks)."""
         logger.info("Starting SMART on FHIR PKCE flow …")
 
-        oauth = OAuth2Session(
-            CLIENT_ID,
-            redirect_uri=REDIRECT_URI,
-            scope=SCOPE,
-            code_challenge_method="S256",
-        )
-
-    
+        oauth = self.session
 
         auth_url = oauth.create_authorization_url(
             f"https://{AUTH_DOMAIN}/authorize",
@@ -111,7 +161,11 @@ class SmartAuth:
         parsed = urlparse(REDIRECT_URI)
         host, port = parsed.hostname, parsed.port or 80
         with _OneShotTCPServer((host, port), _CodeHandler) as srv:
-            while getattr(srv, "code", None) is None:
+            srv.code = None  # type: ignore[attr-defined]
+            # Each handle_request() blocks until one request arrives; we stay
+            # in the loop only for stray hits (favicon etc.) that carry no
+            # code, instead of spinning.
+            while srv.code is None:  # type: ignore[attr-defined]
                 srv.handle_request()
         code: str = srv.code  # type: ignore[attr-defined]
         logger.info("Authorization code received: %s", code)
@@ -127,6 +181,11 @@ class SmartAuth:
             )
             self.token = token_dict["access_token"]
             self.id_token = token_dict.get("id_token")
+            self.refresh_token = token_dict.get("refresh_token")
+            self.expires_at = token_dict.get("expires_at")
+            self._claims = self._decode_claims(self.token)
+            fhir_client.set_token(self.token)
+            self._persist()
             logger.info("Full token response: %s", json.dumps(token_dict, indent=2))
             logger.info("Access token acquired (masked): %s", self._mask(self.token))
         except Exception as e:
@@ -137,30 +196,102 @@ class SmartAuth:
         #self.patient_ref = self._extract_patient()
         return self.token
 
-    def logout(self) -> None:
-        """Clear local token (add revocation call if your IdP supports it)."""
+    def refresh(self) -> Optional[str]:
+        """Silently renew the access token via the refresh token (blocks).
+
+        Returns the new access token, or ``None`` when no refresh token was
+        granted (e.g. the `offline_access` scope was not requested).
+        """
+        if not self.refresh_token:
+            logger.info("No refresh token available; cannot refresh silently.")
+            return None
+        token_dict = self.session.refresh_token(
+            f"https://{AUTH_DOMAIN}/oauth/token",
+            refresh_token=self.refresh_token,
+            client_secret=CLIENT_SECRET,
+        )
+        self.token = token_dict["access_token"]
+        self.refresh_token = token_dict.get("refresh_token", self.refresh_token)
+        self.expires_at = token_dict.get("expires_at")
+        self._claims = self._decode_claims(self.token)
+        fhir_client.set_token(self.token)
+        self._persist()
+        logger.info("Access token refreshed (masked): %s", self._mask(self.token))
+        return self.token
+
+    def logout(self, open_browser: bool = True) -> None:
+        """Clear local token (add revocation call if your IdP supports it).
+
+        ``open_browser=False`` skips the IdP logout redirect – callers that
+        open the logout URL themselves (e.g. off the UI thread) pass False so
+        the browser is launched exactly once and this call never blocks.
+        """
         self.token = None
         self.id_token = None
         self.patient_ref = None
+        self.refresh_token = None
+        self.expires_at = None
+        self._claims = None
+        fhir_client.clear_token()
+        _TOKEN_CACHE_FILE.unlink(missing_ok=True)
         logger.info("SmartAuth: local token cleared.")
-        webbrowser.open(f"https://{AUTH_DOMAIN}/v2/logout?federated&returnTo=http%3A%2F%2Flocalhost%3A8900%2F&client_id={CLIENT_ID }")
+        if open_browser:
+            webbrowser.open(f"https://{AUTH_DOMAIN}/v2/logout?federated&returnTo=http%3A%2F%2Flocalhost%3A8900%2F&client_id={CLIENT_ID }")
 
 
 
     # ------------------------------------------------------------------
     # Helpers
     # ------------------------------------------------------------------
+    def _persist(self) -> None:
+        """Write the current token set to the on-disk cache (best effort)."""
+        try:
+            _TOKEN_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+            payload = json.dumps(
+                {
+                    "key": _cache_key(),
+                    "access_token": self.token,
+                    "id_token": self.id_token,
+                    "refresh_token": self.refresh_token,
+                    "expires_at": self.expires_at,
+                }
+            )
+            # The cache holds bearer and refresh tokens – create it 0600 so
+            # other local users can't read it (write_text would inherit the
+            # umask, typically world-readable).
+            fd = os.open(
+                _TOKEN_CACHE_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+            )
+            with os.fdopen(fd, "w") as fh:
+                fh.write(payload)
+        except OSError as exc:
+            logger.info("Could not persist token cache: %s", exc)
+
+    @staticmethod
+    def _decode_claims(token: Optional[str]) -> Optional[dict]:
+        """Decode the JWT payload segment once (no signature verification)."""
+        if not token:
+            return None
+        parts = token.split(".")
+        if len(parts) != 3:
+            return None
+        try:
+            return json.loads(base64.urlsafe_b64decode(parts[1] + "=="))
+        except Exception as exc:  # noqa: BLE001
+            logger.info("Access token payload decode failed: %s", exc)
+            return None
+
     def _extract_patient(self) -> Optional[str]:
 
         if self.token:
-            try:
-                claims = jwt.get_unverified_claims(self.token)
-                self.patient_ref = claims.get("patient") # store for later
+            if self._claims is None:
+                # Decoded once per token – repeat calls hit the cached dict.
+                self._claims = self._decode_claims(self.token)
+            if self._claims:
+                self.patient_ref = self._claims.get("patient") # store for later
                 logger.info("Patient id reference from access token: %s",  self.patient_ref )
-                return  self.patient_ref 
-            except Exception as exc:  # noqa: BLE001
-                logger.info("Access parse failed: %s", exc)
-                return None
+                return  self.patient_ref
+            return None
        
     @staticmethod
     def _mask(tok: str, n: int = 8) -> str:
@@ -10,9 +10,13 @@ has been removed.
 
 from __future__ import annotations
 
+import atexit
 import logging
+import logging.handlers
+import queue
 from typing import Optional
 
+from textual import work
 from textual.app import App, ComposeResult
 from textual.widgets import (
     Header,
@@ -32,32 +36,24 @@ from smart_auth import SmartAuth  # thin SMART‑on‑FHIR OAuth helper
 # ---------------------------------------------------------------------------
 # Logging configuration
 # ---------------------------------------------------------------------------
+# Log records are only enqueued on the UI thread; a background
+# QueueListener thread owns the file handler and performs the actual disk
+# writes, so event handlers never block on write()/fsync.
+_log_queue: queue.Queue = queue.Queue(-1)
+_file_handler = logging.FileHandler("smart_fhir.log", mode="w")  # overwrite on each run
+_file_handler.setFormatter(
+    logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+)
 logging.basicConfig(
-    filename="smart_fhir.log",
     level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    filemode="w",  # overwrite on each run
+    handlers=[logging.handlers.QueueHandler(_log_queue)],
 )
+_log_listener = logging.handlers.QueueListener(_log_queue, _file_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-# ---------------------------------------------------------------------------
-# Helpers – tiny DTOs for what we need from the FHIR resources
-# ---------------------------------------------------------------------------
-
-def _patient_display_name(patient) -> str:  # type: ignore[annotation-unchecked]
-    """Return a human‑readable display name for a Patient resource."""
-    name = getattr(patient, "name", [])
-    if name:
-        parts: list[str] = []
-        if name[0].given:
-            parts.extend(name[0].given)
-        if name[0].family:
-            parts.append(name[0].family)
-        return " ".join(parts)
-    return "(no name)"
-
-
 # ---------------------------------------------------------------------------
 # Main App
 # ---------------------------------------------------------------------------
@@ -72,6 +68,15 @@ class SmartFHIRDemoV2(App):
     # Will hold the auth helper after login
     auth: Optional[SmartAuth] = None
 
+    def __init__(self) -> None:
+        super().__init__()
+        # Observations already fetched this session, keyed by patient id.
+        # Cleared on logout so a new login never sees another user's data.
+        self._obs_cache: dict[str, list] = {}
+        # Row index → patient id, maintained by _show_patients so the
+        # Observations handler never reads ids back out of the DataTable.
+        self._patient_ids: list[str] = []
+
     # ------------------------------------------------------------------
     # Compose UI
     # ------------------------------------------------------------------
@@ -123,63 +128,80 @@ class SmartFHIRDemoV2(App):
     # ------------------------------------------------------------------
     # Helper – populate patients and observations
     # ------------------------------------------------------------------
+    @work(thread=True, exclusive=True, group="patients")
     def _load_patients(self) -> None:
-        """Fetch and display patients from the FHIR server."""
+        """Fetch patients on a worker thread, then display them.
+
+        The HTTPS round trip runs off the UI thread so the event loop keeps
+        painting; only `_show_patients` (via `call_from_thread`) touches
+        widgets.
+        """
         if not self._require_auth():
             return
 
-        patient_table: DataTable = self.query_one("#patient_table", DataTable)
-        patient_table.clear()
-
         try:
-            patients = fhir.search_patients("_maxresults=10", self.auth.token)
+            # The table only shows id/name/gender/birthDate, so ask the server
+            # for just those elements and skip pydantic validation entirely –
+            # the lite projection returns plain dicts with exactly these keys.
+            patients = fhir.search_patients_lite(
+                "_count=10&_elements=id,name,gender,birthDate", self.auth.token
+            )
         except Exception as exc:
             logger.error("Failed to fetch patients: %s", exc)
             return
 
-        for patient in patients:
-            last_name: str = (
-             patient.name[0].family if patient.name and patient.name[0].family else "(no family name)"
-            )
-            gender = patient.gender
-            birthdate = patient.birthDate
-            patient_table.add_row(patient.id, last_name, gender, birthdate)
-            logger.info("%s – %s", patient.id, last_name, gender, birthdate)
-            logger.info(f"Loaded {len(patients)} patients.")
-
-    def _load_observations_for_patient(self, patient_id, token):
-     if not self._require_auth():
-        return
+        self.call_from_thread(self._show_patients, patients)
 
-     obs_table = self.query_one("#observation_table", DataTable)
-     obs_table.clear()
+    def _show_patients(self, patients: list[dict]) -> None:
+        """Populate the patient table (must run on the UI thread)."""
+        patient_table: DataTable = self.query_one("#patient_table", DataTable)
+        patient_table.clear()
 
-     try:
-        observations = fhir.observations_for_patient(patient_id, self.auth.token)
-     except Exception as exc:
-        logger.error("Failed to fetch observations: %s", exc)
-        return
+        # One add_rows call means one reactive update instead of one per row,
+        # and the summary is logged once instead of inside the loop.
+        rows = [
+            (
+                patient["id"],
+                patient["family"] or "(no family name)",
+                patient["gender"],
+                patient["birthDate"],
+            )
+            for patient in patients
+        ]
+        patient_table.add_rows(rows)
+        self._patient_ids = [patient["id"] for patient in patients]
+        logger.info("Loaded %d patients.", len(rows))
 
-     for obs in observations:
-        code_display = None
-        if getattr(obs, "code", None) and getattr(obs.code, "coding", None):
-            code_display = obs.code.coding[0].display or obs.code.coding[0].code
-        if not code_display:
-            code_display = getattr(obs.code, "text", "(no code)")
+    @work(thread=True, exclusive=True, group="observations")
+    def _load_observations_for_patient(self, patient_id, token):
+        """Fetch a patient's observations on a worker thread, then display them."""
+        if not self._require_auth():
+            return
 
-        value = "-"
-        unit = ""
-        if hasattr(obs, "valueQuantity") and obs.valueQuantity:
-            value = str(obs.valueQuantity.value)
-            unit = obs.valueQuantity.unit or ""
+        cached = self._obs_cache.get(patient_id)
+        if cached is not None:
+            # Repeat click for the same patient – no network round trip.
+            self.call_from_thread(self._show_observations, patient_id, cached)
+            return
 
-        when = getattr(obs, "effectiveDateTime", "") or getattr(
-            getattr(obs, "effectivePeriod", None), "start", ""
-        )
+        try:
+            # The lite projection returns (code, value, unit, when) tuples
+            # built straight from the bundle dicts, so the display path never
+            # walks pydantic attribute machinery per row.
+            rows = fhir.observations_for_patient_lite(patient_id, self.auth.token)
+        except Exception as exc:
+            logger.error("Failed to fetch observations: %s", exc)
+            return
 
-        obs_table.add_row(code_display, value, unit, when)
+        self._obs_cache[patient_id] = rows
+        self.call_from_thread(self._show_observations, patient_id, rows)
 
-     logger.info("Loaded %d observations for patient %s", len(observations), patient_id)
+    def _show_observations(self, patient_id, rows: list[tuple]) -> None:
+        """Populate the observation table (must run on the UI thread)."""
+        obs_table = self.query_one("#observation_table", DataTable)
+        obs_table.clear()
+        obs_table.add_rows(rows)
+        logger.info("Loaded %d observations for patient %s", len(rows), patient_id)
 
 
     # ------------------------------------------------------------------
@@ -219,6 +241,13 @@ class SmartFHIRDemoV2(App):
                 except Exception:
                     pass
                 self.auth = None
+            # Drop per-session data so a subsequent login never sees the
+            # previous user's cached observations or row→id mapping, and
+            # clear the tables so no stale rows are left to click on.
+            self._obs_cache.clear()
+            self._patient_ids.clear()
+            self.query_one("#patient_table", DataTable).clear()
+            self.query_one("#observation_table", DataTable).clear()
             self._update_status("Logged Out", "yellow")
             logger.info("Logged out")
 
@@ -228,10 +257,10 @@ class SmartFHIRDemoV2(App):
 
         elif bid == "observations_btn":
             patient_table: DataTable = self.query_one("#patient_table", DataTable)
-            if patient_table.cursor_row is None:
+            if not self._patient_ids or patient_table.cursor_row is None:
                 logger.error("Please select a patient first.")
                 return
-            patient_id = patient_table.get_row_at(patient_table.cursor_row)[0]
+            patient_id = self._patient_ids[patient_table.cursor_row]
             self._load_observations_for_patient(patient_id, self.auth.token)
             tabs.active = "observations"
 
@@ -2,31 +2,60 @@
 # --------------------------------------------------------------
 from __future__ import annotations
 
+import asyncio
+import atexit
 import logging
+import logging.handlers
+import queue
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
 from datetime import datetime
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from smart_auth import SmartAuth
 
 from textual.app import App, ComposeResult
 from textual.containers import Horizontal
 from textual.widgets import Button, DataTable, Static, Tab
 from textual.widgets import Footer, Label, Markdown, TabbedContent, TabPane
-import webbrowser, os
-
+import os
+from urllib.parse import urlencode
 
-import fhir_client as fhir                # your existing helper
-from smart_auth import SmartAuth          # new PKCE helper
+# fhir_client (pydantic models), smart_auth (authlib/crypto) and webbrowser
+# are deliberately imported inside the handlers that need them: pulling them
+# in at module load delays the first frame of the TUI.
 
 AUTH_DOMAIN   = os.getenv("AUTH0_DOMAIN",   "dev-1h5yru1mv5rucu2k.us.auth0.com")
 CLIENT_ID     = os.getenv("AUTH0_CLIENT_ID", "7i8fQ6U4ATZl53w4lESWLapJBHkZ8d2p")
 
+# Built once at import – AUTH_DOMAIN/CLIENT_ID are read from the environment
+# and never change at runtime.  urlencode also drops the stray space the old
+# per-call f-string interpolated into client_id.
+LOGOUT_URL = f"https://{AUTH_DOMAIN}/v2/logout?federated&" + urlencode(
+    {"returnTo": "http://localhost:8900/", "client_id": CLIENT_ID}
+)
+
 # ---------------------------------------------------------------------------
 # Logging configuration
 # ---------------------------------------------------------------------------
+# Log records are only enqueued on the UI thread; a background
+# QueueListener thread owns the file handler and performs the actual disk
+# writes, so event handlers never block on write()/fsync.
+_log_queue: queue.Queue = queue.Queue(-1)
+_file_handler = logging.FileHandler("smart_fhir.log", mode="w")  # overwrite on each run
+_file_handler.setFormatter(
+    logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+)
 logging.basicConfig(
-    filename="smart_fhir.log",
     level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    filemode="w",  # overwrite on each run
+    handlers=[logging.handlers.QueueHandler(_log_queue)],
 )
+_log_listener = logging.handlers.QueueListener(_log_queue, _file_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
@@ -37,6 +66,136 @@ SMART_SCOPES = [
     "patient/Observation.r",
 ]
 
+# ---------------------------------------------------------------------------
+# App state
+# ---------------------------------------------------------------------------
+
+
+@dataclass(slots=True)
+class AppState:
+    """Mutable portal state in one slotted container.
+
+    Slotted attribute access skips the instance-``__dict__`` lookup, which
+    adds up in handlers that fire many times per second while scrolling.
+    """
+
+    auth: SmartAuth | None = None
+    patient_id: str | None = None
+    # Shared pooled HTTP/2 client – set on first login so importing
+    # fhir_client doesn't slow app startup.
+    http: object | None = None
+    refresh_task: asyncio.Task | None = None
+    # Lazy observation paging – the generator holds the server cursor and
+    # further pages are appended as the user scrolls toward the bottom.
+    obs_pages: Iterator | None = None
+    # In-flight page fetch kicked off by scrolling; held (like logout_task
+    # below) because a bare create_task can be garbage-collected before it
+    # ever runs.
+    obs_fetch_task: asyncio.Task | None = None
+    # Holds the threaded webbrowser.open at logout – a bare create_task can
+    # be garbage-collected before it ever runs.
+    logout_task: asyncio.Task | None = None
+    obs_loading: bool = False
+    # Parsed effectiveDateTime per observation row key – lets sorting or
+    # filtering reuse real datetimes instead of re-parsing ISO strings.
+    obs_when: dict = field(default_factory=dict)
+    # Serializes login/logout so a double-click cannot launch two browser
+    # flows or two token exchanges.
+    login_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # Widget refs cached in on_ready so handlers skip DOM queries.
+    status: Static | None = None
+    logout_btn: Button | None = None
+    demo_table: DataTable | None = None
+    obs_table: DataTable | None = None
+
+
+# ---------------------------------------------------------------------------
+# Row projection
+# ---------------------------------------------------------------------------
+
+
+@lru_cache(maxsize=512)
+def _parse_when(when: str) -> datetime | None:
+    """Parse an ISO-8601 effective time; cached because timestamps repeat
+    across paginated bundles."""
+    try:
+        return datetime.fromisoformat(when.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def _row_from_obs(obs) -> tuple:
+    """Project one Observation into ((code, value, unit, when), when_dt).
+
+    Lives at module scope so the loop body runs on fast locals; each model
+    attribute is read once and bound instead of repeated getattr/hasattr
+    chains per row.  The effective time is parsed to a real datetime once at
+    ingestion – the display string goes into the row, the datetime rides
+    along for later sorting/filtering.
+    """
+    code = obs.code
+    coding = code.coding if code else None
+    if coding:
+        first = coding[0]
+        code_display = first.display or first.code
+    elif code is not None and code.text:
+        code_display = code.text
+    else:
+        code_display = "(no code)"
+
+    quantity = obs.valueQuantity
+    if quantity:
+        value = str(quantity.value)
+        unit = quantity.unit or ""
+    else:
+        value, unit = "-", ""
+
+    period = obs.effectivePeriod
+    when = obs.effectiveDateTime or (period.start if period else "")
+    when_dt = _parse_when(str(when)) if when else None
+    when_display = when_dt.strftime("%Y-%m-%d %H:%M") if when_dt else when
+    return (code_display, value, unit, when_display), when_dt
+
+
+# ---------------------------------------------------------------------------
+# Cached DataTable
+# ---------------------------------------------------------------------------
+
+
+class CachedDataTable(DataTable):
+    """DataTable that memoizes `_get_row_renderables` per row index.
+
+    Textual rebuilds the row renderables O(m²) times while rendering m rows
+    (addressed upstream in Textual PR #5959); until we can pin a release
+    containing that fix, caching here makes repeat lookups O(1).  The cache
+    is validated against the widget's ``_update_count``, which Textual bumps
+    on *every* mutation (add/remove/update/sort/add_columns), so stale cells
+    or headers are never rendered.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._row_renderables_cache: dict[int, object] = {}
+        self._row_renderables_update_count = -1
+
+    def _get_row_renderables(self, row_index: int):
+        if self._row_renderables_update_count != self._update_count:
+            self._row_renderables_cache.clear()
+            self._row_renderables_update_count = self._update_count
+        cached = self._row_renderables_cache.get(row_index)
+        if cached is None:
+            cached = super()._get_row_renderables(row_index)
+            self._row_renderables_cache[row_index] = cached
+        return cached
+
+    def add_rows(self, rows, height: int | None = None):
+        if height is None:
+            return super().add_rows(rows)
+        # Textual's bulk API has no height parameter; forwarding an explicit
+        # height per row lets the widget skip measuring every cell.
+        return [super(CachedDataTable, self).add_row(*row, height=height) for row in rows]
+
+
 # ---------------------------------------------------------------------------
 # Main Textual app
 # ---------------------------------------------------------------------------
@@ -48,8 +207,67 @@ class PatientPortal(App):
 
     def __init__(self) -> None:
         super().__init__()
-        self.auth: SmartAuth | None = None
-        self.patient_id: str | None = None
+        self.state = AppState()
+
+    # --------------------------  Lifecycle  --------------------------------
+
+    def on_mount(self) -> None:
+        self.state.refresh_task = asyncio.create_task(self._token_refresher())
+
+    def on_ready(self) -> None:
+        """Cache widget references once the full DOM exists.
+
+        Each query_one() walks the DOM with a CSS selector; handlers fire far
+        more often than widgets change, so one lookup here turns every later
+        access into a plain attribute read.  (`on_ready` rather than
+        `on_mount` because the tables live inside TabPanes, which finish
+        mounting after the app itself.)
+        """
+        self.state.status = self.query_one("#status", Static)
+        self.state.logout_btn = self.query_one("#logout", Button)
+        self.state.demo_table = self.query_one("#demo_table", DataTable)
+        self.state.obs_table = self.query_one("#obs_table", DataTable)
+
+        # Columns are static – create them once here.  The data helpers only
+        # clear() rows, so a login/logout cycle no longer re-allocates Column
+        # objects (or stacks duplicate columns, as the old clear()+
+        # add_columns pairing did).
+        self.state.demo_table.add_columns("Field", "Value")
+        self.state.obs_table.add_columns("Code", "Value", "Unit", "When")
+
+        # Plain single-line text in every cell: turn off the per-row extras
+        # the widget would otherwise measure and render.
+        for table in (self.state.demo_table, self.state.obs_table):
+            table.show_row_labels = False
+            table.zebra_stripes = False
+            table.fixed_columns = 0
+
+    async def _token_refresher(self) -> None:
+        """Renew the access token ~5 minutes before expiry, in the background.
+
+        Keeping self.state.auth.token warm means button handlers never pay refresh
+        latency inline; the existing per-request error handling remains as a
+        fallback if a refresh fails.
+        """
+        while True:
+            auth = self.state.auth
+            if auth is None or auth.expires_at is None:
+                await asyncio.sleep(30)
+                continue
+            await asyncio.sleep(max(1, auth.expires_at - time.time() - 300))
+            if self.state.auth is not auth or auth.token is None:
+                continue
+            if not auth.refresh_token:
+                # No offline_access grant means refresh() can never succeed;
+                # without this check the loop would spin at 1 Hz once the
+                # token came within five minutes of expiry.
+                logger.info("No refresh token granted; background refresh stopped.")
+                return
+            try:
+                await asyncio.to_thread(auth.refresh)
+            except Exception as exc:
+                logger.error("Background token refresh failed: %s", exc)
+                await asyncio.sleep(60)
 
     # --------------------------  UI compose  -------------------------------
 
@@ -61,9 +279,9 @@ class PatientPortal(App):
 
         with TabbedContent(id="main_tabs"):
             with TabPane("Demographics", id="tab_demo"):
-                yield DataTable(id="demo_table")
+                yield CachedDataTable(id="demo_table")
             with TabPane("Observations", id="tab_obs"):
-                yield DataTable(id="obs_table")
+                yield CachedDataTable(id="obs_table")
 
     # --------------------------  Event handlers  ---------------------------
 
@@ -71,67 +289,111 @@ class PatientPortal(App):
         if event.button.id == "login":
             await self._handle_login()
         elif event.button.id == "logout":
-            self._handle_logout()
+            await self._handle_logout()
 
     # --------------------------  Login / Logout  ---------------------------
 
     async def _handle_login(self) -> None:
-        if self.auth and self.auth.token:
-            logger.info("Already logged in.")
-            return
-
-       
-        try:
-            self.auth = SmartAuth()
-            self.auth.login()               # blocking, opens browser
-        except Exception as exc:
-            logger.error("Login failed: %s", exc)
-            return
-
-        self.auth.patient_ref = self.auth._extract_patient()
-        # Extract patient context
-        if not self.auth.patient_ref:
-            logger.info("No patient context in token/userinfo.")
-            return
-        #self.patient_id = self.auth.patient_ref.split("/")[-1]
-        self.patient_id = self.auth.patient_ref
-
-        # Update UI
-        self.query_one("#logout", Button).disabled = False
-        self.query_one("#status", Static).update(
-            f"[green]Logged in – Patient {self.patient_id}[/green]"
-        )
-
-        # Fetch & show data
-        patient = fhir.get_patient(self.patient_id, self.auth.token)
-        self._show_demographics(patient)
-        self._load_observations()
-        # switch to Observations tab
-        tabs: TabbedContent = self.query_one("#main_tabs", TabbedContent)
-        tabs.active = "tab_obs"
+        import fhir_client as fhir
+        from smart_auth import SmartAuth
+
+        # The lock (plus disabling the button) makes a rapid double-click
+        # wait for the first flow instead of opening two browser tabs and
+        # exchanging two codes.
+        async with self.state.login_lock:
+            if self.state.auth and self.state.auth.token:
+                logger.info("Already logged in.")
+                return
+
+            if self.state.http is None:
+                # Every fetch this app triggers rides the same keep-alive pool.
+                self.state.http = fhir.get_client()
+
+            login_btn = self.query_one("#login", Button)
+            login_btn.disabled = True
+            try:
+                # A still-valid token on disk skips the whole browser round trip.
+                self.state.auth = SmartAuth.load_cached()
+                if self.state.auth is None:
+                    try:
+                        self.state.auth = SmartAuth()
+                        # login() blocks on the browser redirect – run it on a
+                        # thread so the reactor keeps painting while the user
+                        # authenticates.
+                        await asyncio.to_thread(self.state.auth.login)
+                    except Exception as exc:
+                        logger.error("Login failed: %s", exc)
+                        return
+
+                self.state.auth.patient_ref = self.state.auth._extract_patient()
+                # Extract patient context
+                if not self.state.auth.patient_ref:
+                    logger.info("No patient context in token/userinfo.")
+                    return
+                #self.state.patient_id = self.state.auth.patient_ref.split("/")[-1]
+                self.state.patient_id = self.state.auth.patient_ref
+
+                if self.state.refresh_task is None or self.state.refresh_task.done():
+                    self.state.refresh_task = asyncio.create_task(self._token_refresher())
+
+                # Update UI
+                self.state.logout_btn.disabled = False
+                self.state.status.update(
+                    f"[green]Logged in – Patient {self.state.patient_id}[/green]"
+                )
+
+                # Fetch & show data – one batch_update so the compositor paints
+                # a single frame for the whole post-login mutation instead of
+                # one per table/tab touch.
+                patient = await asyncio.to_thread(
+                    fhir.get_patient, self.state.patient_id, self.state.auth.token
+                )
+                tabs: TabbedContent = self.query_one("#main_tabs", TabbedContent)
+                with self.batch_update():
+                    self._show_demographics(patient)
+                    await self._load_observations()
+                    # switch to Observations tab
+                    tabs.active = "tab_obs"
+            finally:
+                login_btn.disabled = False
 
       
 
    
     
 
-    def _handle_logout(self) -> None:
-        if self.auth:
-            self.auth.logout()
-        self.patient_id = None
-        self.query_one("#logout", Button).disabled = True
-        self.query_one("#status", Static).update("[yellow]Logged out[/yellow]")
-        self.query_one("#demo_table", DataTable).clear()
-        self.query_one("#obs_table", DataTable).clear()
-        webbrowser.open(f"https://{AUTH_DOMAIN}/v2/logout?federated&returnTo=http%3A%2F%2Flocalhost%3A8900%2F&client_id={CLIENT_ID }")
+    async def _handle_logout(self) -> None:
+        import webbrowser
+
+        async with self.state.login_lock:
+            if self.state.refresh_task is not None:
+                self.state.refresh_task.cancel()
+                self.state.refresh_task = None
+            if self.state.auth:
+                # open_browser=False: the IdP logout open happens on the
+                # thread below, so logout() only clears local state here and
+                # the browser is launched exactly once.
+                self.state.auth.logout(open_browser=False)
+            self.state.patient_id = None
+            self.state.obs_pages = None
+            self.state.obs_when.clear()
+            with self.batch_update():
+                self.state.logout_btn.disabled = True
+                self.state.status.update("[yellow]Logged out[/yellow]")
+                self.state.demo_table.clear()
+                self.state.obs_table.clear()
+            # webbrowser.open can block while probing for a browser – fire it
+            # on a thread so the logout click returns immediately.
+            self.state.logout_task = asyncio.create_task(
+                asyncio.to_thread(webbrowser.open, LOGOUT_URL)
+            )
 
 
     # --------------------------  Data helpers  -----------------------------
 
     def _show_demographics(self, patient) -> None:
-        table: DataTable = self.query_one("#demo_table", DataTable)
+        table = self.state.demo_table
         table.clear()
-        table.add_columns("Field", "Value")
 
         name = (
             f"{patient.name[0].given[0]} {patient.name[0].family}"
@@ -142,37 +404,65 @@ class PatientPortal(App):
         table.add_row("Birth Date", patient.birthDate or "—")
         table.add_row("Patient ID", patient.id)
 
-    def _load_observations(self) -> None:
-        obs_table: DataTable = self.query_one("#obs_table", DataTable)
+    async def _load_observations(self) -> None:
+        obs_table = self.state.obs_table
         obs_table.clear()
-        obs_table.add_columns("Code", "Value", "Unit", "When")
+        self.state.obs_when.clear()
+
+        import fhir_client as fhir
+
+        # Page through the server instead of materializing every row up
+        # front; scrolling near the bottom pulls in the next page.
+        # The table renders four columns, so have the server strip every
+        # other element before the bundle ever crosses the wire.
+        self.state.obs_pages = fhir.iter_observation_pages(
+            self.state.patient_id,
+            self.state.auth.token,
+            count=50,
+            elements="code,valueQuantity,effectiveDateTime,effectivePeriod",
+        )
+        await self._append_next_obs_page()
 
+    async def _append_next_obs_page(self) -> None:
+        if self.state.obs_pages is None or self.state.obs_loading:
+            return
+        self.state.obs_loading = True
         try:
-            observations = fhir.observations_for_patient(
-                self.patient_id, self.auth.token
-            )
+            observations = await asyncio.to_thread(next, self.state.obs_pages, None)
         except Exception as exc:
             logger.info("Failed to fetch observations: %s", exc)
+            self.state.obs_pages = None
+            return
+        finally:
+            self.state.obs_loading = False
+        if observations is None:
+            self.state.obs_pages = None  # all pages consumed
             return
 
-        for obs in observations:
-            if getattr(obs, "code", None) and obs.code.coding:
-                code_display = obs.code.coding[0].display or obs.code.coding[0].code
-            else:
-                code_display = getattr(obs, "code", {}).get("text", "(no code)")
+        projected = list(map(_row_from_obs, observations))
+        rows = [row for row, _ in projected]
+
+        # One bulk insert inside a batch_update = one layout/paint instead of
+        # one refresh per observation.
+        obs_table = self.state.obs_table
+        with self.batch_update():
+            # height=1 skips per-row cell measurement – observation cells are
+            # always single-line.
+            row_keys = obs_table.add_rows(rows, height=1)
+        self.state.obs_when.update(
+            (key, when_dt) for key, (_, when_dt) in zip(row_keys, projected)
+        )
 
-            value, unit = "-", ""
-            if hasattr(obs, "valueQuantity") and obs.valueQuantity:
-                value = str(obs.valueQuantity.value)
-                unit = obs.valueQuantity.unit or ""
+        logger.info("Loaded %d observations (%d total)", len(rows), obs_table.row_count)
 
-            when = (
-                getattr(obs, "effectiveDateTime", "")
-                or getattr(getattr(obs, "effectivePeriod", None), "start", "")
+    def on_data_table_row_highlighted(self, event: DataTable.RowHighlighted) -> None:
+        """Fetch the next observation page when the cursor nears the bottom."""
+        if event.data_table.id != "obs_table" or self.state.obs_pages is None:
+            return
+        if event.cursor_row >= event.data_table.row_count - 5:
+            self.state.obs_fetch_task = asyncio.create_task(
+                self._append_next_obs_page()
             )
-            obs_table.add_row(code_display, value, unit, when)
-
-        logger.info("Loaded %d observations", len(observations))
 
 # ---------------------------------------------------------------------------
 # Run
@@ -1,4 +1,5 @@
 import logging
+import logging.handlers
 from typing import List
 
 from textual.app import App, ComposeResult
@@ -27,11 +28,20 @@ SMART_SCOPES = [
 # ---------------------------------------------------------------------------
 # Logging configuration
 # ---------------------------------------------------------------------------
+# INFO records are buffered in memory and only flushed to disk in batches
+# (or immediately on WARNING and above), so UI event handlers never block on
+# a file write per log call.
+_file_handler = logging.FileHandler("smart_fhir.log", mode="w")  # overwrite on each run
+_file_handler.setFormatter(
+    logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+)
 logging.basicConfig(
-    filename="smart_fhir.log",
     level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    filemode="w",  # Overwrite on each run
+    handlers=[
+        logging.handlers.MemoryHandler(
+            capacity=1024, flushLevel=logging.WARNING, target=_file_handler
+        )
+    ],
 )
 logger = logging.getLogger(__name__)
 
@@ -66,15 +76,18 @@ class SmartFHIRDemo(App):
     # ------------------------------------------------------------------
     def on_mount(self):
         """Initialize widgets after the DOM is ready."""
-        table = self.query_one("#patient_table", DataTable)
-        table.add_columns("FHIR ID", "Last Name")
-        table.cursor_type = "row"  # nicer UX when selecting rows
+        # Cache the widgets handlers touch – query_one walks the DOM with a
+        # CSS selector on every call.
+        self._table = self.query_one("#patient_table", DataTable)
+        self._status = self.query_one("#status", Static)
+        self._table.add_columns("FHIR ID", "Last Name")
+        self._table.cursor_type = "row"  # nicer UX when selecting rows
 
     # ------------------------------------------------------------------
     # Helper – update login status label
     # ------------------------------------------------------------------
     def _set_status(self, logged_in: bool) -> None:
-        status = self.query_one("#status", Static)
+        status = self._status
         if logged_in:
             status.update("[green]Logged In[/green]")
         else:
@@ -84,8 +97,8 @@ class SmartFHIRDemo(App):
     # Event Handlers
     # ------------------------------------------------------------------
     def on_button_pressed(self, event):
-    
-        table: DataTable = self.query_one("#patient_table", DataTable)
+
+        table: DataTable = self._table
 
         if event.button.id == "login":
             self.auth = SmartAuth()
@@ -120,16 +133,24 @@ class SmartFHIRDemo(App):
                 logger.error("FHIR request failed: %s", exc)
                 return
 
-            # Clear prior table data and repopulate
+            # Clear prior table data and repopulate – rows are collected
+            # first so the table refreshes once, not once per patient.
             table.clear()
-            for patient in patients:
-                last_name: str = (
-                    patient.name[0].family if patient.name and patient.name[0].family else "(no family name)"
+            rows = [
+                (
+                    patient.id,
+                    patient.name[0].family if patient.name and patient.name[0].family else "(no family name)",
                 )
-                table.add_row(patient.id, last_name)
-                logger.info("%s – %s", patient.id, last_name)
+                for patient in patients
+            ]
+
+            with self.batch_update():
+                table.add_rows(rows)
 
-            logger.info(f"Loaded {len(patients)} patients.")
+            # One formatted log record for the whole batch instead of one
+            # write per patient.
+            entries = "\n".join(f"{pid} – {name}" for pid, name in rows)
+            logger.info("Loaded %d patients:\n%s", len(rows), entries)
 
 
 if __name__ == "__main__":